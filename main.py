@@ -1,64 +1,207 @@
 import os
-import json
+import re
 import asyncio
 import sqlite3
-from datetime import datetime, timezone
+import time
+import hashlib
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 from pathlib import Path
-from fastapi import FastAPI, Query
-from fastapi.responses import FileResponse, Response, HTMLResponse
+from fastapi import Depends, FastAPI, Query
+from fastapi.responses import FileResponse, Response, HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.requests import Request
 from sqlalchemy import make_url
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.sql import text
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import httpx
+import orjson
 import logging
-from typing import List, Optional
+from typing import AsyncIterator, Iterable, List, Optional
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
-from cachetools import TTLCache
+from cachetools import LRUCache, TTLCache
 
 # Basic logging setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Quantize steps (4 dp ratios/WETH, 2 dp USD), shared instead of re-parsed on every call
+_Q4 = Decimal('0.0001')
+_Q2 = Decimal('0.01')
+
+# Ratios are handled as ints scaled by 10**4 (their stored precision), so the
+# change check and message math are plain integer/float ops, not Decimal
+RATIO_SCALE = 10000
+
+def _to_fp(x) -> int:
+    """Parse a 4-dp ratio (str, float or Decimal) into a fixed-point int."""
+    return int(round(float(x) * RATIO_SCALE))
+
+def _fp_str(n: int) -> str:
+    """Format a fixed-point ratio with its 4 decimal places."""
+    return f"{n / RATIO_SCALE:.4f}"
+
 # SQLite stores Decimals as text so they round-trip exactly (like Postgres NUMERIC)
 sqlite3.register_adapter(Decimal, str)
 
 # Get DATABASE_URL from environment (defaults to a local SQLite file)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./data/xsushi.db")
 
-# FastAPI application instance
-app = FastAPI(title="XSushi Ratio Tracker")
+# Application lifespan: set up shared resources, scheduler and bot polling on
+# startup, then tear them down in reverse order on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()  # Ensure SQLite file + tables exist
+    # The built index.html never changes while the process runs; keep it in memory
+    # instead of reading it from disk inside request handlers
+    with open("static/index.html", "rb") as f:
+        app.state.index_html = f.read().decode("utf-8")
+    app.state.ssr_template = build_ssr_template(app.state.index_html)
+    # One pooled HTTP/2 client shared by all outbound calls (keeps TLS connections alive)
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=15.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=30.0),
+    ) as client:
+        app.state.http = client
+        # Independent warm-up steps run concurrently, so startup takes as long as
+        # the slowest one (usually the GraphQL fetch) rather than their sum
+        await asyncio.gather(
+            warm_db_pool(),
+            load_subscribers(),
+            check_and_save(to_check_only=True),  # Initial check without notifications
+        )
+        # Started only now, so a tick never broadcasts to a partially loaded SUBSCRIBERS
+        scheduler_task = asyncio.create_task(hourly_loop())
+        logger.info("Scheduler started")
+        bot_task = asyncio.create_task(start_bot())  # Start bot polling in background
+
+        yield
+
+        # Stop the scheduler and any broadcast before the bot, all before the HTTP client closes
+        for task in (scheduler_task, *_broadcast_tasks):
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        # Let aiogram wind down its own polling task (and close the bot session);
+        # cancel only if polling hasn't actually started yet
+        if not bot_task.done():
+            try:
+                await dp.stop_polling()
+            except RuntimeError:
+                bot_task.cancel()
+        try:
+            await bot_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Bot polling failed: {e}")
 
-# Database engine and session generator
-engine = create_async_engine(DATABASE_URL, echo=False, connect_args={"timeout": 30})
-async def get_session() -> AsyncSession:
-    async with AsyncSession(engine) as session:
+# FastAPI application instance
+app = FastAPI(title="XSushi Ratio Tracker", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# Database engine and session generator.
+# aiosqlite defaults to NullPool (a new connection + worker thread per session),
+# so keep a queue of warm connections instead; sizes are tunable via env.
+# An in-memory database exists only per connection, so it keeps the dialect's
+# default single shared connection (StaticPool).
+DB_PATH = make_url(DATABASE_URL).database
+IS_FILE_DB = bool(DB_PATH) and DB_PATH != ":memory:"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+_POOL_OPTIONS = dict(
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_recycle=1800,
+) if IS_FILE_DB else {}
+engine = create_async_engine(DATABASE_URL, echo=False, connect_args={"timeout": 30}, **_POOL_OPTIONS)
+async_session_maker = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+
+# FastAPI dependency: one session per request
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with async_session_maker() as session:
         yield session
 
 SCHEMA_STATEMENTS = [
     "CREATE TABLE IF NOT EXISTS xsushi (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, ratio TEXT NOT NULL)",
     "CREATE INDEX IF NOT EXISTS idx_xsushi_timestamp ON xsushi (timestamp DESC)",
+    # Keep only the newest row per UTC day, so databases written before the
+    # unique daily index existed can still get it (no-op once it does)
+    "DELETE FROM xsushi WHERE id NOT IN (SELECT MAX(id) FROM xsushi GROUP BY date(timestamp))",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_xsushi_day ON xsushi (date(timestamp))",
     "CREATE TABLE IF NOT EXISTS subscribers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE NOT NULL, subscribed_at TEXT NOT NULL)",
     "CREATE INDEX IF NOT EXISTS idx_subscribers_user_id ON subscribers (user_id)",
 ]
 
+# Every query the app runs, declared once so each call reuses the same
+# TextClause (and its SQLAlchemy compiled-statement cache entry)
+_SQL_PING = text("SELECT 1")
+# Overall last ratio (change check) + latest ratio before today (base for the change %)
+_SQL_LAST_AND_PRIOR_DAY = text(
+    "SELECT (SELECT ratio FROM xsushi ORDER BY timestamp DESC LIMIT 1), "
+    "(SELECT ratio FROM xsushi WHERE timestamp < :day_start ORDER BY timestamp DESC LIMIT 1)"
+)
+# Insert today's record, or overwrite it if one already exists
+_SQL_UPSERT_TODAY = text(
+    "INSERT INTO xsushi (timestamp, ratio) VALUES (:now, :ratio) "
+    "ON CONFLICT (date(timestamp)) DO UPDATE SET ratio = excluded.ratio, timestamp = excluded.timestamp"
+)
+_SQL_LAST2 = text("SELECT ratio, timestamp FROM xsushi ORDER BY timestamp DESC LIMIT 2")
+_SQL_SUBSCRIBER_IDS = text("SELECT user_id FROM subscribers")
+_SQL_UPSERT_SUB = text(
+    "INSERT INTO subscribers (user_id, subscribed_at) VALUES (:user_id, :now) ON CONFLICT (user_id) DO NOTHING"
+)
+_SQL_DELETE_SUB = text("DELETE FROM subscribers WHERE user_id = :user_id")
+# History query variants keyed by (has from_date, has to_date)
+_SQL_HISTORY = {
+    (False, False): text("SELECT timestamp, ratio FROM xsushi ORDER BY timestamp ASC"),
+    (True, False): text("SELECT timestamp, ratio FROM xsushi WHERE timestamp >= :from_date ORDER BY timestamp ASC"),
+    (False, True): text("SELECT timestamp, ratio FROM xsushi WHERE timestamp <= :to_date ORDER BY timestamp ASC"),
+    (True, True): text(
+        "SELECT timestamp, ratio FROM xsushi WHERE timestamp >= :from_date AND timestamp <= :to_date ORDER BY timestamp ASC"
+    ),
+}
+
 async def init_db():
     """Create the SQLite database file + tables on startup."""
-    db_path = make_url(DATABASE_URL).database
-    if db_path and db_path != ":memory:":
-        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    if IS_FILE_DB:
+        Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
     async with engine.begin() as conn:
+        # WAL lets readers (API, crawler renders) run alongside the writer
+        # instead of holding a lock that blocks /start and the hourly upsert
+        await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
         for stmt in SCHEMA_STATEMENTS:
             await conn.execute(text(stmt))
 
-def now_iso() -> str:
-    """Current UTC time as a sortable ISO-8601 string (second precision, +00:00)."""
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+# Subscribed chat ids, loaded once at startup and kept in sync by /start and
+# /stop; the subscribers table remains the source of truth across restarts
+SUBSCRIBERS: set[int] = set()
+
+async def load_subscribers():
+    """Fill SUBSCRIBERS from the database."""
+    async with async_session_maker() as session:
+        result = await session.execute(_SQL_SUBSCRIBER_IDS)
+        SUBSCRIBERS.update(result.scalars())
+
+async def warm_db_pool():
+    """Open DB_POOL_SIZE connections up front so the first requests skip the connect cost."""
+    if not IS_FILE_DB:
+        return  # Single shared connection, already opened by init_db()
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(_SQL_PING)
+    await asyncio.gather(*(ping() for _ in range(DB_POOL_SIZE)))
+
+def utc_now() -> datetime:
+    """Current UTC time at second precision; .isoformat() gives the stored, sortable form (+00:00)."""
+    return datetime.now(timezone.utc).replace(microsecond=0)
 
 def parse_ts(value):
     """Convert an SQLite timestamp (TEXT ISO) back into a timezone-aware datetime."""
@@ -68,6 +211,18 @@ def parse_ts(value):
     return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
 
 balance_cache = TTLCache(maxsize=1, ttl=30)
+# 10**decimals for every realistic ERC-20 `decimals` value (Decimal power is slow)
+_POW10 = [Decimal(10) ** i for i in range(31)]
+# Latest fetched ratio; the upstream value only moves on reward distribution.
+# Short TTL so the hourly check never acts on a value older than a minute.
+ratio_cache = TTLCache(maxsize=1, ttl=60)
+_ratio_fetch_lock = asyncio.Lock()
+# Historical rows keyed by (from_date, to_date); cleared whenever a ratio is saved
+history_cache = TTLCache(maxsize=128, ttl=60)
+# Time of the last saved ratio change (process start until then); part of the /api/ratio-data ETag
+last_ratio_mtime = time.time()
+# Encoded /api/ratio-data bodies keyed by ETag; old ETags simply age out
+ratio_response_cache = LRUCache(maxsize=128)
 
 TREASURY_ADDRESSES = [
     "0x5ad6211CD3fdE39A9cECB5df6f380b8263d1e277",
@@ -87,30 +242,29 @@ async def get_treasury_balance_usd() -> dict:
         url = f"https://api.ethplorer.io/getAddressInfo/{address}?apiKey={key}"
 
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(url, timeout=15.0)
-                resp.raise_for_status()
-                data = resp.json()
+            resp = await app.state.http.get(url, timeout=15.0)
+            resp.raise_for_status()
+            data = orjson.loads(resp.content)
 
-                for token in data.get("tokens", []):
-                    token_info = token.get("tokenInfo", {})
-                    symbol = token_info.get("symbol", "")
-                    price_info = token_info.get("price")
+            for token in data.get("tokens", ()):
+                token_info = token.get("tokenInfo", {})
+                price_info = token_info.get("price")
+                decimals = int(token_info.get("decimals", 18))
+                scale = _POW10[decimals] if decimals < len(_POW10) else Decimal(10) ** decimals
 
-                    balance_raw = Decimal(token["balance"]) / Decimal(10) ** int(token_info.get("decimals", 18))
+                balance_raw = Decimal(token["balance"]) / scale
 
-                    if symbol == "WETH":
-                        total_weth += balance_raw
+                if token_info.get("symbol") == "WETH":
+                    total_weth += balance_raw
 
-                    if price_info and "rate" in price_info:
-                        price = Decimal(price_info["rate"])
-                        total_usd += balance_raw * price
+                if price_info and "rate" in price_info:
+                    total_usd += balance_raw * Decimal(price_info["rate"])
 
         except Exception as e:
             logger.error(f"Ethplorer error for {address}: {e}")
 
-    total_usd = total_usd.quantize(Decimal('0.01'))
-    total_weth = total_weth.quantize(Decimal('0.0001'))
+    total_usd = total_usd.quantize(_Q2)
+    total_weth = total_weth.quantize(_Q4)
 
     result = {
         "balance_usd": float(total_usd),
@@ -122,138 +276,253 @@ async def get_treasury_balance_usd() -> dict:
     return result
 
     
+SUSHI_GRAPHQL_URL = 'https://production.data-gcp.sushi.com/graphql'
+# The GraphQL request never changes, so serialize it once
+_SUSHI_BODY = orjson.dumps({
+    "operationName": "SushiBarStats",
+    "query": "query SushiBarStats {\n  sushiBarStats {\n    xSushiSushiRatio\n  }\n}",
+    "variables": {}
+})
+_JSON_HEADERS = {"content-type": "application/json"}
+
 # Fetch current xSushiSushiRatio from SushiSwap GraphQL API
-async def fetch_ratio() -> Optional[Decimal]:
-    url = 'https://production.data-gcp.sushi.com/graphql'
-    query = {
-        "operationName": "SushiBarStats",
-        "query": "query SushiBarStats {\n  sushiBarStats {\n    xSushiSushiRatio\n  }\n}",
-        "variables": {}
-    }
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(url, json=query, timeout=10.0)
+async def fetch_ratio() -> Optional[int]:
+    if "ratio" in ratio_cache:
+        return ratio_cache["ratio"]
+
+    # Single-flight: concurrent callers wait for one request instead of each
+    # issuing their own, then pick up its cached result
+    async with _ratio_fetch_lock:
+        if "ratio" in ratio_cache:
+            return ratio_cache["ratio"]
+
+        try:
+            resp = await app.state.http.post(SUSHI_GRAPHQL_URL, content=_SUSHI_BODY, headers=_JSON_HEADERS, timeout=10.0)
             resp.raise_for_status()
-            data = resp.json()
-            ratio = Decimal(str(data['data']['sushiBarStats']['xSushiSushiRatio'])).quantize(Decimal('0.0001'))
-            logger.info(f"Fetched ratio: {ratio}")
+            data = orjson.loads(resp.content)
+            ratio = _to_fp(data['data']['sushiBarStats']['xSushiSushiRatio'])
+            logger.info(f"Fetched ratio: {_fp_str(ratio)}")
+            ratio_cache["ratio"] = ratio
             return ratio
-    except Exception as e:
-        logger.error(f"Fetch error: {str(e)}")
-        return None
+        except Exception as e:
+            logger.error(f"Fetch error: {str(e)}")
+            return None
+
+def _build_notify_msg(
+    header: str,
+    new_fp: int,
+    prev_fp: int,
+    last_change_date_str: str,
+    total_usd: float,
+    weth_balance: float,
+    fees_label: str,
+) -> str:
+    """Ratio summary shared by the change notification and the /start welcome."""
+    change_percent = abs(new_fp - prev_fp) / prev_fp * 100
+    return (
+        f"{header}\n"
+        f"xSushi/Sushi = {RATIO_SCALE / new_fp:.4f}\n"
+        f"Sushi/xSushi = {_fp_str(new_fp)}\n"
+        f"Last change date: {last_change_date_str}\n"
+        f"Last change: {change_percent:.2f}%\n\n"
+        f"{fees_label}:\n"
+        f"~${total_usd:,.0f} ({weth_balance:.2f} WETH)\n\n"
+        "View the chart:\nhttps://xsushi.mywire.org\n\n"
+        "To unsubscribe, use /stop"
+    )
+
+class TokenBucket:
+    """Minimal asyncio token bucket: acquire() waits until a token is available."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Telegram allows ~30 messages/s per bot; stay safely below it
+SEND_CONCURRENCY = 25
+send_rate_limiter = TokenBucket(rate=25, capacity=25)
+
+# In-flight broadcasts (strong refs so they aren't garbage-collected mid-send)
+_broadcast_tasks: set[asyncio.Task] = set()
+
+# Send the same message to every subscriber. Ids are handed to a fixed pool of
+# SEND_CONCURRENCY workers through a bounded queue.
+async def broadcast(user_ids: Iterable[int], message: str):
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_CONCURRENCY * 2)
+
+    async def send_one(user_id: int):
+        await send_rate_limiter.acquire()
+        try:
+            await bot.send_message(chat_id=user_id, text=message, disable_web_page_preview=True)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await bot.send_message(chat_id=user_id, text=message, disable_web_page_preview=True)
+
+    async def worker():
+        while (user_id := await queue.get()) is not None:
+            try:
+                await send_one(user_id)
+            except Exception as e:
+                logger.error(f"Failed to send to {user_id}: {e}")
+
+    workers = [asyncio.create_task(worker()) for _ in range(SEND_CONCURRENCY)]
+    try:
+        for user_id in user_ids:
+            await queue.put(user_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    except asyncio.CancelledError:
+        # Shutdown: stop sending right away instead of draining the queue
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+# Serializes check_and_save runs (hourly tick vs. startup check) so a ratio
+# change can't be saved or announced twice
+_check_lock = asyncio.Lock()
+# Last ratio known to be stored; lets an unchanged tick skip the database
+_last_known_ratio: Optional[int] = None
 
 # Check for new ratio and save if changed; send notifications if updated (one record per day)
 async def check_and_save(to_check_only: bool = False):
-    new_ratio = await fetch_ratio()
-    if new_ratio is None:
-        return
-
-    async for session in get_session():
-        # Get overall last record to check for any change
-        result = await session.execute(text("SELECT ratio, timestamp FROM xsushi ORDER BY timestamp DESC LIMIT 1"))
-        last_row = result.fetchone()
-        last_ratio = Decimal(str(last_row[0])) if last_row else None
-        
-        if last_ratio is None or abs(new_ratio - last_ratio) >= Decimal('0.0001'):
-            # Check if there's a record for today
-            today = datetime.now(timezone.utc).date().isoformat()
-            now = now_iso()
-            today_result = await session.execute(
-                text("SELECT id FROM xsushi WHERE date(timestamp) = :today"),
-                {"today": today}
-            )
-            today_exists = today_result.fetchone() is not None
-            
-            if today_exists:
-                # Update today's record
-                await session.execute(
-                    text("UPDATE xsushi SET ratio = :ratio, timestamp = :now WHERE date(timestamp) = :today"),
-                    {"ratio": new_ratio, "now": now, "today": today}
-                )
-                logger.info(f"Updated today's ratio: {new_ratio}")
-            else:
-                # Insert new record for today
-                await session.execute(
-                    text("INSERT INTO xsushi (timestamp, ratio) VALUES (:now, :ratio)"),
-                    {"now": now, "ratio": new_ratio}
-                )
-                logger.info(f"Inserted new ratio for today: {new_ratio}")
-            
+    global _last_known_ratio, last_ratio_mtime
+    async with _check_lock:
+        new_ratio = await fetch_ratio()
+        if new_ratio is None:
+            return
+        if new_ratio == _last_known_ratio:
+            logger.info(f"Ratio unchanged overall, skipped: {_fp_str(new_ratio)}")
+            return
+
+        # One clock reading per tick, so the stored row and the message agree
+        now = utc_now()
+        # Start of the current UTC day, in the same ISO format as stored timestamps,
+        # so the predicate below is a plain range on the indexed column
+        day_start = now.replace(hour=0, minute=0, second=0).isoformat()
+
+        async with async_session_maker() as session:
+            # One read for both the overall last record (change check) and the latest
+            # record before today (base for the change % once today's row is written)
+            result = await session.execute(_SQL_LAST_AND_PRIOR_DAY, {"day_start": day_start})
+            last_row = result.fetchone()
+            last_ratio = _to_fp(last_row[0]) if last_row[0] is not None else None
+
+            if last_ratio is not None and new_ratio == last_ratio:
+                _last_known_ratio = new_ratio
+                logger.info(f"Ratio unchanged overall, skipped: {_fp_str(new_ratio)} (last: {_fp_str(last_ratio)})")
+                return
+
+            # The treasury balance is only needed for the notification; fetch it while the row is written
+            balance_task = None if to_check_only else asyncio.create_task(get_treasury_balance_usd())
+
+            await session.execute(_SQL_UPSERT_TODAY, {"now": now.isoformat(), "ratio": _fp_str(new_ratio)})
             await session.commit()
-            
-            if not to_check_only:
-                # Prepare notification message (change % from previous overall record)
-                balance_data = await get_treasury_balance_usd()
-                total_usd = balance_data["balance_usd"]
-                weth_balance = balance_data["weth_balance"]
-                prev_result = await session.execute(text("SELECT ratio FROM xsushi ORDER BY timestamp DESC LIMIT 2"))
-                prev_rows = prev_result.fetchall()
-                prev_ratio = Decimal(str(prev_rows[1][0])) if len(prev_rows) > 1 else new_ratio
-                change_percent = abs((new_ratio - prev_ratio) / prev_ratio * 100).quantize(Decimal('0.01'))
-                last_change_date_str = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M')
-                xsushi_sushi = (1 / new_ratio).quantize(Decimal('0.0001'))
-                sushi_xsushi = new_ratio
-                message = f"Reward distributed!\nxSushi/Sushi = {xsushi_sushi}\nSushi/xSushi = {sushi_xsushi}\nLast change date: {last_change_date_str}\nLast change: {change_percent}%\n\nRemaining fees to be distributed:\n~${total_usd:,.0f} ({weth_balance:.2f} WETH)\n\nView the chart:\nhttps://xsushi.mywire.org\n\nTo unsubscribe, use /stop"
-                
-                # Get subscribers and send notifications
-                sub_result = await session.execute(text("SELECT user_id FROM subscribers"))
-                subscribers = [row[0] for row in sub_result.fetchall()]
-                for user_id in subscribers:
-                    try:
-                        await bot.send_message(chat_id=user_id, text=message, disable_web_page_preview=True)
-                        await asyncio.sleep(0.05)  # Small pause
-                    except Exception as e:
-                        logger.error(f"Failed to send to {user_id}: {e}")
-        else:
-            logger.info(f"Ratio unchanged overall, skipped: {new_ratio} (last: {last_ratio})")
-
-# Scheduler instance for periodic tasks
-scheduler = AsyncIOScheduler()
-
-# Startup event: initialize scheduler, run initial check, start bot polling
-@app.on_event("startup")
-async def startup_event():
-    await init_db()  # Ensure SQLite file + tables exist
-    scheduler.add_job(check_and_save, 'cron', hour='*', minute=0, id='hourly_check', replace_existing=True)
-    scheduler.start()
-    await check_and_save(to_check_only=True)  # Initial check without notifications
-    logger.info("Scheduler started")
-    asyncio.create_task(start_bot())  # Start bot polling in background
-
-# Shutdown event: stop scheduler and bot polling
-@app.on_event("shutdown")
-async def shutdown_event():
-    scheduler.shutdown()
-    if dp:
-        await dp.stop_polling()
+            logger.info(f"Saved ratio for today: {_fp_str(new_ratio)}")
+
+        _last_known_ratio = new_ratio
+        # Serve the new ratio on the next /api/ratio-data or crawler hit
+        last_ratio_mtime = time.time()
+        history_cache.clear()
+        ssr_cache.clear()
+
+        if not to_check_only:
+            # Prepare notification message (change % from previous overall record)
+            balance_data = await balance_task
+            prev_ratio = _to_fp(last_row[1]) if last_row[1] is not None else new_ratio
+            message = _build_notify_msg(
+                "Reward distributed!",
+                new_ratio, prev_ratio,
+                now.strftime('%Y-%m-%d %H:%M'),
+                balance_data["balance_usd"], balance_data["weth_balance"],
+                "Remaining fees to be distributed"
+            )
+
+            # Send notifications in the background so the check (and its lock)
+            # finishes right away; snapshot, since /start and /stop may change
+            # the set mid-broadcast
+            task = asyncio.create_task(broadcast(tuple(SUBSCRIBERS), message))
+            _broadcast_tasks.add(task)
+            task.add_done_callback(_broadcast_tasks.discard)
+
+# Periodic task: run check_and_save at the top of every UTC hour
+async def hourly_loop():
+    while True:
+        next_run = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        # Loop in case the sleep wakes up marginally before the hour
+        while (now := datetime.now(timezone.utc)) < next_run:
+            await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            await check_and_save()
+        except Exception as e:
+            logger.error(f"Hourly check failed: {e}")
 
 # Helper function to get historical data
-async def fetch_historical_data(from_date: Optional[str] = None, to_date: Optional[str] = None):
-    query = "SELECT timestamp, ratio FROM xsushi WHERE 1=1"
+async def fetch_historical_data(session: AsyncSession, from_date: Optional[str] = None, to_date: Optional[str] = None):
+    cache_key = (from_date or None, to_date or None)
+    if cache_key in history_cache:
+        logger.debug(f"History cache hit: {cache_key}")
+        return history_cache[cache_key]
+    logger.debug(f"History cache miss: {cache_key}")
+
     params = {}
     if isinstance(from_date, str) and from_date:
-        query += " AND timestamp >= :from_date"
         params['from_date'] = datetime.fromisoformat(f"{from_date}T00:00:00+00:00").isoformat()
     if isinstance(to_date, str) and to_date:
-        query += " AND timestamp <= :to_date"
         params['to_date'] = datetime.fromisoformat(f"{to_date}T23:59:59+00:00").isoformat()
-    query += " ORDER BY timestamp ASC"
-
-    async for session in get_session():
-        result = await session.execute(text(query), params)
-        rows = result.fetchall()
-        return [
-            {"timestamp": row[0], "ratio": float(row[1])}
-            for row in rows
-        ]
+    query = _SQL_HISTORY["from_date" in params, "to_date" in params]
+    # A ratio saved while the rows stream in makes them stale; don't cache them then
+    mtime = last_ratio_mtime
+
+    # Stream rows in batches straight into the response dicts instead of
+    # materializing an intermediate fetchall() list of Row objects
+    result = await session.stream(query, params, execution_options={"yield_per": 1000})
+    data = [
+        {"timestamp": row[0], "ratio": float(row[1])}
+        async for row in result
+    ]
+    if last_ratio_mtime == mtime:
+        history_cache[cache_key] = data
+    return data
 
 # API endpoint for frontend data
 @app.get("/api/ratio-data")
 async def get_ratio_data(
+    request: Request,
     from_date: Optional[str] = Query(None),
-    to_date: Optional[str] = Query(None)
+    to_date: Optional[str] = Query(None),
+    session: AsyncSession = Depends(get_session)
 ):
-    return await fetch_historical_data(from_date, to_date)
+    # The data only changes when check_and_save saves a ratio, so the ETag is
+    # derived from the query params and the time of that last save
+    mtime = last_ratio_mtime
+    etag = '"' + hashlib.md5(f"{from_date}|{to_date}|{mtime}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    body = ratio_response_cache.get(etag)
+    if body is None:
+        body = orjson.dumps(await fetch_historical_data(session, from_date, to_date))
+        # Only keep the body if no ratio was saved while it was built
+        if last_ratio_mtime == mtime:
+            ratio_response_cache[etag] = body
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/api/balance")
 async def api_balance():
@@ -278,93 +547,117 @@ Allow: /static/
 Allow: /about
 """, media_type="text/plain")
 
+# Extended list of bots (SEO + Social Previews)
+BOT_USER_AGENTS = [
+    # Search Engines
+    "googlebot", "bingbot", "yandex", "duckduckbot", "slurp",
+    "baiduspider", "sogou", "360spider", "exabot", "coccocbot",
+
+    # Social Media & Messengers (Crucial for previews)
+    "telegrambot", "twitterbot", "facebookexternalhit", "whatsapp",
+    "discordbot", "slackbot", "linkedinbot", "pinterest", "vkshare",
+    "skypeuripreview",
+
+    # AI & Tools
+    "gptbot", "perplexitybot", "anthropic-ai", "claudebot",
+    "grokaibot", "xai-retriever", "applebot",
+    "ahrefsbot", "semrushbot", "majestic", "mj12bot",
+    "screaming frog", "sitebulb", "curl", "wget", "python-requests"
+]
+# One compiled alternation instead of a substring scan per entry. Entries that
+# contain "bot" are already matched by the generic "bot" branch, so they are
+# left out of the pattern to keep the alternation short.
+_BOT_RE = re.compile(
+    "|".join([re.escape(bot) for bot in BOT_USER_AGENTS if "bot" not in bot] + ["bot"]),
+    re.IGNORECASE
+)
+
+# Turn index.html into a str.format_map template: escape literal braces, then
+# mark the title, description, canonical link and hydration script slots
+def build_ssr_template(html: str) -> str:
+    template = html.replace("{", "{{").replace("}", "}}")
+
+    # Title
+    template = template.replace("<title>xSushi Ratio</title>", "<title>{title}</title>")
+
+    # Description
+    original_desc_prefix = 'content="Track the xSUSHI/SUSHI staking ratio on SushiSwap over time. Monitor DeFi yields and staking metrics."'
+    template = template.replace(original_desc_prefix, 'content="{description}"')
+
+    # Canonical Link
+    original_canonical = '<link rel="canonical" href="https://xsushi.mywire.org">'
+    template = template.replace(original_canonical, '<link rel="canonical" href="{canonical}">')
+
+    # Hydration data, inserted before </body>
+    return template.replace("</body>", "<script>window.__INITIAL_DATA__ = {initial_data};</script></body>")
+
+# Rendered crawler HTML per path; cleared whenever a new ratio is saved
+ssr_cache = TTLCache(maxsize=4, ttl=60)
+
 # Root endpoint for React app with SSR replacement logic
 # Handles root "/" AND "/about" to support SPA routing
 @app.get("/", response_class=HTMLResponse)
 @app.get("/about", response_class=HTMLResponse)
 async def root(request: Request):
-    user_agent = request.headers.get("user-agent", "").lower()
-
-    # Extended list of bots (SEO + Social Previews)
-    bots = [
-        # Search Engines
-        "googlebot", "bingbot", "yandex", "duckduckbot", "slurp",
-        "baiduspider", "sogou", "360spider", "exabot", "coccocbot",
-
-        # Social Media & Messengers (Crucial for previews)
-        "telegrambot", "twitterbot", "facebookexternalhit", "whatsapp",
-        "discordbot", "slackbot", "linkedinbot", "pinterest", "vkshare",
-        "skypeuripreview",
-
-        # AI & Tools
-        "gptbot", "perplexitybot", "anthropic-ai", "claudebot",
-        "grokaibot", "xai-retriever", "applebot",
-        "ahrefsbot", "semrushbot", "majestic", "mj12bot",
-        "screaming frog", "sitebulb", "curl", "wget", "python-requests"
-    ]
-
-    is_bot = any(bot in user_agent for bot in bots) or "bot" in user_agent
+    is_bot = _BOT_RE.search(request.headers.get("user-agent", "")) is not None
 
     if is_bot:
         # Determine which page is requested to adjust SEO title
         path = request.url.path
-
-        # 1. Get Fresh Data (needed for main page SEO and injection)
-        ratio_data = await fetch_historical_data()
-        balance_data = await get_treasury_balance_usd()
-
-        # Get latest values for Meta Tags
-        last_ratio = ratio_data[-1]['ratio'] if ratio_data else 0
-        balance_usd = balance_data.get('balance_usd', 0)
-
-        # Prepare JSON for Hydration
-        full_initial_data = {
-            "ratioData": ratio_data,
-            "balanceData": balance_data
-        }
-        json_data = json.dumps(full_initial_data)
+        if path in ssr_cache:
+            return HTMLResponse(content=ssr_cache[path])
 
         try:
-            with open("static/index.html", "r", encoding="utf-8") as f:
-                html_content = f.read()
-
-            # 2. Inject JSON Data (Server Side Injection)
-            # Inserts <script> before </body>
-            script_injection = f'<script>window.__INITIAL_DATA__ = {json_data};</script>'
-
-            # 3. Update SEO Meta Tags based on Route
-            if path == "/about":
-                seo_title = "How SushiSwap Staking Works | xSushi Deep Dive"
-                seo_desc = "A comprehensive guide to SushiSwap staking mechanics, fee distribution, and the SushiMaker contract logic."
-                canonical_link = "https://xsushi.mywire.org/about"
-            else:
-                seo_title = f"Sushi Ratio: {last_ratio:.4f} | Treasury: ${balance_usd:,.0f}"
-                seo_desc = f"Current xSushi/Sushi ratio is {last_ratio:.4f}. Fees awaiting distribution: ${balance_usd:,.0f}."
-                canonical_link = "https://xsushi.mywire.org"
-
-            # Replace Title
-            html_content = html_content.replace("<title>xSushi Ratio</title>", f"<title>{seo_title}</title>")
-
-            # Replace Description
-            original_desc_prefix = 'content="Track the xSUSHI/SUSHI staking ratio on SushiSwap over time. Monitor DeFi yields and staking metrics."'
-            html_content = html_content.replace(original_desc_prefix, f'content="{seo_desc}"')
-
-            # Replace Canonical Link
-            original_canonical = '<link rel="canonical" href="https://xsushi.mywire.org">'
-            html_content = html_content.replace(original_canonical, f'<link rel="canonical" href="{canonical_link}">')
-
-            # Inject Script
-            final_html = html_content.replace("</body>", f"{script_injection}</body>")
-
+            final_html = await render_bot_html(path)
+            ssr_cache[path] = final_html
             return HTMLResponse(content=final_html)
 
         except Exception as e:
             logger.error(f"Error injecting data: {e}")
-            # Fallback to standard file if injection fails
-            return FileResponse("static/index.html")
+            # Fallback to standard page if injection fails
+            return HTMLResponse(content=app.state.index_html)
 
     # For normal users
-    return FileResponse("static/index.html")
+    return HTMLResponse(content=app.state.index_html)
+
+# Render index.html with SEO tags and hydration data for crawlers
+async def render_bot_html(path: str) -> str:
+    # Own session, closed as soon as the rows are read, so the pooled connection
+    # isn't held while the balance is fetched from Ethplorer
+    async def load_history():
+        async with async_session_maker() as session:
+            return await fetch_historical_data(session)
+
+    # 1. Get Fresh Data (needed for main page SEO and injection)
+    ratio_data, balance_data = await asyncio.gather(
+        load_history(),
+        get_treasury_balance_usd()
+    )
+
+    # Get latest values for Meta Tags
+    last_ratio = ratio_data[-1]['ratio'] if ratio_data else 0
+    balance_usd = balance_data.get('balance_usd', 0)
+
+    # Update SEO Meta Tags based on Route
+    if path == "/about":
+        seo_title = "How SushiSwap Staking Works | xSushi Deep Dive"
+        seo_desc = "A comprehensive guide to SushiSwap staking mechanics, fee distribution, and the SushiMaker contract logic."
+        canonical_link = "https://xsushi.mywire.org/about"
+    else:
+        seo_title = f"Sushi Ratio: {last_ratio:.4f} | Treasury: ${balance_usd:,.0f}"
+        seo_desc = f"Current xSushi/Sushi ratio is {last_ratio:.4f}. Fees awaiting distribution: ${balance_usd:,.0f}."
+        canonical_link = "https://xsushi.mywire.org"
+
+    # Fill every slot (SEO tags + JSON for hydration) in a single pass
+    return app.state.ssr_template.format_map({
+        "title": seo_title,
+        "description": seo_desc,
+        "canonical": canonical_link,
+        "initial_data": orjson.dumps({
+            "ratioData": ratio_data,
+            "balanceData": balance_data
+        }).decode(),
+    })
 
 # Telegram bot setup
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -380,42 +673,45 @@ dp = Dispatcher(storage=storage)
 @dp.message(Command("start"))
 async def start_handler(message: types.Message):
     user_id = message.from_user.id
-    async for session in get_session():
-        # Add subscriber if not exists
-        await session.execute(
-            text("INSERT INTO subscribers (user_id, subscribed_at) VALUES (:user_id, :now) ON CONFLICT (user_id) DO NOTHING"),
-            {"user_id": user_id, "now": now_iso()}
-        )
+    now = utc_now()
+    # The balance is independent of the database work; fetch it meanwhile
+    balance_task = asyncio.create_task(get_treasury_balance_usd())
+
+    # Add subscriber if not exists and read current data in one transaction;
+    # users already in SUBSCRIBERS are stored, so only the read is needed
+    async with async_session_maker() as session:
+        if user_id not in SUBSCRIBERS:
+            await session.execute(_SQL_UPSERT_SUB, {"user_id": user_id, "now": now.isoformat()})
+        result = await session.execute(_SQL_LAST2)
+        rows = result.fetchall()
         await session.commit()
-    
+    SUBSCRIBERS.add(user_id)
+
     # Send current data
-    async for session in get_session():
-        result = await session.execute(text("SELECT ratio, timestamp FROM xsushi ORDER BY timestamp DESC LIMIT 2"))
-        rows = result.fetchall()
-        balance_data = await get_treasury_balance_usd()
-        total_usd = balance_data["balance_usd"]
-        weth_balance = balance_data["weth_balance"]
-        if rows:
-            last_ratio = Decimal(str(rows[0][0]))
-            prev_ratio = Decimal(str(rows[1][0])) if len(rows) > 1 else last_ratio
-            last_timestamp = parse_ts(rows[0][1])
-            xsushi_sushi = (1 / last_ratio).quantize(Decimal('0.0001'))
-            sushi_xsushi = last_ratio
-            change_percent = abs((last_ratio - prev_ratio) / prev_ratio * 100).quantize(Decimal('0.01')) if len(rows) > 1 else Decimal('0.00')
-            date_str = datetime.now(timezone.utc).date().isoformat()
-            last_change_date_str = last_timestamp.strftime('%Y-%m-%d %H:%M')
-            welcome_msg = f"Welcome! You're subscribed to xSushi ratio updates.\n\nDate: {date_str}\nxSushi/Sushi = {xsushi_sushi}\nSushi/xSushi = {sushi_xsushi}\nLast change date: {last_change_date_str}\nLast change: {change_percent}%\n\nFees awaiting distribution:\n~${total_usd:,.0f} ({weth_balance:.2f} WETH)\n\nView the chart:\nhttps://xsushi.mywire.org\n\nTo unsubscribe, use /stop"
-            await bot.send_message(chat_id=user_id, text=welcome_msg, disable_web_page_preview=True)
-        else:
-            await bot.send_message(chat_id=user_id, text="Welcome! No data yet, check back soon.\n\nView the chart:\nhttps://xsushi.mywire.org\n\nTo unsubscribe, use /stop", disable_web_page_preview=True)
+    balance_data = await balance_task
+    if rows:
+        last_ratio = _to_fp(rows[0][0])
+        prev_ratio = _to_fp(rows[1][0]) if len(rows) > 1 else last_ratio
+        date_str = now.date().isoformat()
+        welcome_msg = _build_notify_msg(
+            f"Welcome! You're subscribed to xSushi ratio updates.\n\nDate: {date_str}",
+            last_ratio, prev_ratio,
+            parse_ts(rows[0][1]).strftime('%Y-%m-%d %H:%M'),
+            balance_data["balance_usd"], balance_data["weth_balance"],
+            "Fees awaiting distribution"
+        )
+        await bot.send_message(chat_id=user_id, text=welcome_msg, disable_web_page_preview=True)
+    else:
+        await bot.send_message(chat_id=user_id, text="Welcome! No data yet, check back soon.\n\nView the chart:\nhttps://xsushi.mywire.org\n\nTo unsubscribe, use /stop", disable_web_page_preview=True)
 
 # Bot command: /stop - unsubscribe user
 @dp.message(Command("stop"))
 async def stop_handler(message: types.Message):
     user_id = message.from_user.id
-    async for session in get_session():
-        await session.execute(text("DELETE FROM subscribers WHERE user_id = :user_id"), {"user_id": user_id})
+    async with async_session_maker() as session:
+        await session.execute(_SQL_DELETE_SUB, {"user_id": user_id})
         await session.commit()
+    SUBSCRIBERS.discard(user_id)
     
     await bot.send_message(chat_id=user_id, text="You've unsubscribed from xSushi ratio updates.\n\nView the chart:\nhttps://xsushi.mywire.org\n\nUse /start to subscribe again.", disable_web_page_preview=True)
 